@@ -1,8 +1,14 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import plotly.express as px
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 from datetime import datetime
+import hashlib
+import io
 import os
 import calendar
 
@@ -14,7 +20,7 @@ st.set_page_config(
 )
 
 # Style personnalisé
-st.markdown("""
+_CSS = """
     <style>
     .main {
         background-color: #f8f9fa;
@@ -46,7 +52,39 @@ st.markdown("""
         box-shadow: 0 2px 4px rgba(0,0,0,0.1);
     }
     </style>
-    """, unsafe_allow_html=True)
+    """
+st.markdown(_CSS, unsafe_allow_html=True)
+
+# Format des dates des exports MEXC
+_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Noms possibles de la colonne de date, avant et après renommage
+_DATE_COLUMNS = ('Heure', 'Date')
+
+# Au-delà de ce nombre de jours, le PnL journalier est affiché par semaine
+_MAX_DAILY_BARS = 500
+
+# Mise en page commune des graphiques en barres
+_BAR_LAYOUT = dict(
+    showlegend=False,
+    plot_bgcolor='white',
+    paper_bgcolor='white',
+    font=dict(
+        family="Arial",
+        size=12,
+        color="#2c3e50"
+    ),
+    margin=dict(l=40, r=40, t=40, b=40)
+)
+
+# Au-delà de ce nombre de barres, les étiquettes se chevauchent et sont masquées
+_MAX_LABELED_BARS = 50
+
+# Hauteur de chaque graphique d'une figure à plusieurs lignes (défaut de Plotly)
+_CHART_HEIGHT = 450
+
+# Noms des mois, de janvier à décembre
+_MONTH_NAMES = tuple(calendar.month_name[i] for i in range(1, 13))
 
 def format_pnl(value):
     """Formate le PnL avec un + pour les valeurs positives"""
@@ -56,12 +94,33 @@ def format_percentage(value):
     """Formate un pourcentage"""
     return f"{value:.1f}%"
 
-def load_data(uploaded_file):
+def _groupby_sum(keys, values, sort=False):
+    """Somme des valeurs par clé, les clés et valeurs manquantes sont ignorées"""
+    codes, uniques = pd.factorize(keys, sort=sort)
+    valid = (codes >= 0) & ~np.isnan(values)
+    sums = np.bincount(codes[valid], weights=values[valid], minlength=len(uniques))
+    return np.asarray(uniques), sums
+
+def file_key(uploaded_file):
+    """Empreinte du contenu du fichier importé"""
+    return hashlib.blake2b(uploaded_file.getbuffer(), digest_size=16).hexdigest()
+
+@st.cache_data(show_spinner=False)
+def load_data(key, _file_bytes, filename):
     """Charge les données depuis un fichier Excel ou CSV"""
-    if uploaded_file.name.endswith('.xlsx'):
-        df = pd.read_excel(uploaded_file)
+    # Le cache est indexé sur key (voir file_key) : Streamlit ne hache pas
+    # les paramètres préfixés par un underscore comme _file_bytes
+    buffer = io.BytesIO(_file_bytes)
+    if filename.endswith('.xlsx'):
+        df = pd.read_excel(buffer, engine="calamine")
     else:
-        df = pd.read_csv(uploaded_file)
+        # Lecteur CSV de pyarrow, la date restant du texte : sinon pyarrow
+        # convertit les dates avec décalage horaire en UTC
+        convert_options = pacsv.ConvertOptions(
+            column_types={column: pa.string() for column in _DATE_COLUMNS},
+            strings_can_be_null=True
+        )
+        df = pacsv.read_csv(buffer, convert_options=convert_options).to_pandas()
     
     # Renommer les colonnes pour correspondre à notre format
     column_mapping = {
@@ -72,113 +131,212 @@ def load_data(uploaded_file):
     
     # Ne renommer que les colonnes qui existent
     existing_columns = {k: v for k, v in column_mapping.items() if k in df.columns}
-    df = df.rename(columns=existing_columns)
+    df.rename(columns=existing_columns, inplace=True)
     
     # Convertir la date en format datetime
     if 'Date' in df.columns:
-        df['Date'] = pd.to_datetime(df['Date'])
+        try:
+            df['Date'] = pd.to_datetime(df['Date'], format=_DATE_FORMAT)
+        except ValueError:
+            # Format inattendu : on laisse pandas le déduire
+            df['Date'] = pd.to_datetime(df['Date'])
+        
+        # Dates avec fuseau : garder l'heure locale de l'export, sans fuseau,
+        # pour que les calculs reçoivent des datetime64
+        if isinstance(df['Date'].dtype, pd.DatetimeTZDtype):
+            df['Date'] = df['Date'].dt.tz_localize(None)
+        
+        # Années présentes, calculées une seule fois pour le sélecteur d'année
+        years = np.unique(df['Date'].to_numpy().astype('datetime64[Y]'))
+        df.attrs['years'] = (years[~np.isnat(years)].astype('int64') + 1970).tolist()
+    
+    # Les paires reviennent souvent : les coder en catégories
+    if 'Asset' in df.columns:
+        df['Asset'] = df['Asset'].astype('category')
     
     return df
 
 def calculate_monthly_pnl(df, selected_year=None):
     """Calcule le PnL mensuel avec tous les mois de l'année"""
-    df['Year'] = df['Date'].dt.year
-    df['Month'] = df['Date'].dt.month
+    # Seules les colonnes Date et PnL sont utiles au calcul
+    dates = df['Date'].to_numpy()
+    pnl = df['PnL'].to_numpy()
     
     # Si une année est sélectionnée, filtrer les données
     if selected_year:
-        df = df[df['Year'] == selected_year]
+        # Comparer aux bornes de l'année plutôt que d'extraire l'année de chaque date
+        start = np.datetime64(str(selected_year), 'Y')
+        mask = (dates >= start) & (dates < start + 1)
+        dates = dates[mask]
+        pnl = pnl[mask]
     
-    # Créer un DataFrame avec tous les mois
-    all_months = pd.DataFrame({
-        'Month': range(1, 13),
-        'Month_Name': [calendar.month_name[i] for i in range(1, 13)]
-    })
+    # Mois de chaque trade (0 à 11), les PnL manquants sont ignorés
+    valid = ~np.isnat(dates) & ~np.isnan(pnl)
+    months = dates[valid].astype('datetime64[M]').astype('int64') % 12
     
-    # Calculer le PnL par mois
-    monthly_pnl = df.groupby('Month')['PnL'].sum().reset_index()
+    # Calculer le PnL par mois, les mois sans trade restent à 0
+    sums = np.bincount(months, weights=pnl[valid], minlength=12)
     
-    # Fusionner avec tous les mois
-    monthly_pnl = all_months.merge(monthly_pnl, on='Month', how='left')
-    monthly_pnl['PnL'] = monthly_pnl['PnL'].fillna(0)
+    monthly_pnl = pd.DataFrame({
+        'Month': np.arange(1, 13),
+        'Month_Name': _MONTH_NAMES,
+        'PnL': sums
+    })
     
     return monthly_pnl
 
 def calculate_daily_pnl(df):
     """Calcule le PnL journalier"""
-    daily_pnl = df.groupby('Date')['PnL'].sum().reset_index()
+    # Même type de colonnes que le cas général (jours en datetime64[s])
+    if df.empty:
+        return pd.DataFrame({'Date': pd.Series(dtype='datetime64[s]'), 'PnL': pd.Series(dtype=float)})
+    
+    # Regrouper par jour calendaire, sans l'heure des trades
+    days = df['Date'].to_numpy().astype('datetime64[D]')
+    valid = ~np.isnat(days)
+    
+    # Grouper sur les numéros de jour en int64, sans trier les trades
+    keys, sums = _groupby_sum(days[valid].view('i8'), df['PnL'].to_numpy()[valid])
+    
+    # Seuls les jours agrégés sont remis dans l'ordre chronologique
+    order = np.argsort(keys)
+    daily_pnl = pd.DataFrame({
+        'Date': keys[order].view('datetime64[D]'),
+        'PnL': sums[order]
+    })
     return daily_pnl
 
+def calculate_weekly_pnl(daily_pnl):
+    """Regroupe le PnL journalier par semaine, datée du lundi"""
+    days = daily_pnl['Date'].to_numpy().astype('datetime64[D]').view('i8')
+    
+    # Le 1er janvier 1970 (jour 0) est un jeudi, d'où le décalage de 3 jours
+    mondays = days - (days + 3) % 7
+    
+    # Les jours sont déjà triés, les semaines le sont donc aussi
+    keys, sums = _groupby_sum(mondays, daily_pnl['PnL'].to_numpy())
+    weekly_pnl = pd.DataFrame({
+        'Date': keys.view('datetime64[D]'),
+        'PnL': sums
+    })
+    return weekly_pnl
+
 def calculate_asset_pnl(df):
     """Calcule le PnL par asset"""
     if 'Asset' not in df.columns:
         return None
-    asset_pnl = df.groupby('Asset')['PnL'].sum().reset_index()
+    assets, sums = _groupby_sum(df['Asset'], df['PnL'].to_numpy(), sort=True)
+    asset_pnl = pd.DataFrame({'Asset': assets, 'PnL': sums})
     return asset_pnl
 
-def create_pnl_bar_chart(df, x, y, title, labels=None):
-    """Crée un graphique en barres avec couleurs conditionnelles"""
-    colors = ['#2ecc71' if val >= 0 else '#e74c3c' for val in df[y]]
+def create_pnl_bar_trace(df, x, y):
+    """Crée les barres du PnL, colorées selon leur signe"""
+    values = df[y].to_numpy()
+    colors = np.where(values >= 0, '#2ecc71', '#e74c3c')
     
-    fig = go.Figure()
-    fig.add_trace(go.Bar(
-        x=df[x],
-        y=df[y],
+    # Même rendu que format_pnl, appliqué à toute la série
+    if len(values) <= _MAX_LABELED_BARS:
+        signs = np.where(values > 0, '+', '')
+        text = np.char.add(signs, np.char.mod('%.2f', values))
+    else:
+        text = None
+    
+    return go.Bar(
+        x=df[x].to_numpy(),
+        y=values,
         marker_color=colors,
-        text=[format_pnl(val) for val in df[y]],
+        text=text,
         textposition='auto',
-    ))
+    )
+
+def create_pnl_bar_chart(df, x, y, title, labels=None):
+    """Crée un graphique en barres avec couleurs conditionnelles"""
+    fig = go.Figure()
+    fig.add_trace(create_pnl_bar_trace(df, x, y))
     
     fig.update_layout(
+        _BAR_LAYOUT,
         title=title,
-        showlegend=False,
         xaxis_title=labels.get(x, x) if labels else x,
-        yaxis_title=labels.get(y, y) if labels else y,
-        plot_bgcolor='white',
-        paper_bgcolor='white',
-        font=dict(
-            family="Arial",
-            size=12,
-            color="#2c3e50"
-        ),
-        margin=dict(l=40, r=40, t=40, b=40)
+        yaxis_title=labels.get(y, y) if labels else y
     )
     
     return fig
 
+def create_pnl_subplots(charts):
+    """Regroupe plusieurs graphiques en barres dans une seule figure"""
+    # Chaque élément de charts reprend les arguments de create_pnl_bar_chart
+    fig = make_subplots(
+        rows=len(charts), cols=1,
+        subplot_titles=[title for _, _, _, title, _ in charts]
+    )
+    
+    for row, (df, x, y, title, labels) in enumerate(charts, start=1):
+        fig.add_trace(create_pnl_bar_trace(df, x, y), row=row, col=1)
+        fig.update_xaxes(title_text=labels.get(x, x) if labels else x, row=row, col=1)
+        fig.update_yaxes(title_text=labels.get(y, y) if labels else y, row=row, col=1)
+    
+    fig.update_layout(_BAR_LAYOUT, height=_CHART_HEIGHT * len(charts))
+    
+    return fig
+
 def calculate_win_loss_stats(df):
     """Calcule les statistiques de gains/pertes"""
     stats = {}
     
-    # Séparer les trades gagnants et perdants
-    winning_trades = df[df['PnL'] > 0]
-    losing_trades = df[df['PnL'] < 0]
-    neutral_trades = df[df['PnL'] == 0]
+    # Classer chaque trade : 0 = perte, 1 = neutre, 2 = gain
+    pnl = df['PnL'].to_numpy(dtype=np.float64)
+    pnl = pnl[~np.isnan(pnl)]
+    classes = (np.sign(pnl) + 1).astype(np.intp)
+    
+    # Nombre de trades et somme du PnL par classe, en un passage chacun
+    counts = np.bincount(classes, minlength=3)
+    sums = np.bincount(classes, weights=pnl, minlength=3)
     
     # Nombre de trades
     stats['total_trades'] = len(df)
-    stats['winning_trades'] = len(winning_trades)
-    stats['losing_trades'] = len(losing_trades)
-    stats['neutral_trades'] = len(neutral_trades)
+    stats['winning_trades'] = int(counts[2])
+    stats['losing_trades'] = int(counts[0])
+    stats['neutral_trades'] = int(counts[1])
     
     # Win rate
     stats['win_rate'] = (stats['winning_trades'] / stats['total_trades'] * 100) if stats['total_trades'] > 0 else 0
     
+    # Somme des gains et des pertes (en valeur absolue)
+    total_wins = sums[2]
+    total_losses = -sums[0]
+    
     # PnL moyen
-    stats['avg_win'] = winning_trades['PnL'].mean() if len(winning_trades) > 0 else 0
-    stats['avg_loss'] = losing_trades['PnL'].mean() if len(losing_trades) > 0 else 0
+    stats['avg_win'] = total_wins / stats['winning_trades'] if stats['winning_trades'] > 0 else 0
+    stats['avg_loss'] = -total_losses / stats['losing_trades'] if stats['losing_trades'] > 0 else 0
     
-    # PnL maximum et minimum
-    stats['max_win'] = winning_trades['PnL'].max() if len(winning_trades) > 0 else 0
-    stats['max_loss'] = losing_trades['PnL'].min() if len(losing_trades) > 0 else 0
+    # PnL maximum et minimum : le plus gros gain est le maximum global s'il y a des gains
+    stats['max_win'] = pnl.max() if stats['winning_trades'] > 0 else 0
+    stats['max_loss'] = pnl.min() if stats['losing_trades'] > 0 else 0
     
     # Profit factor (somme des gains / somme des pertes en valeur absolue)
-    total_wins = winning_trades['PnL'].sum()
-    total_losses = abs(losing_trades['PnL'].sum())
     stats['profit_factor'] = total_wins / total_losses if total_losses != 0 else float('inf')
     
     return stats
 
+@st.fragment
+def monthly_pnl_section(df):
+    """Affiche le PnL mensuel, seule cette section est réexécutée au changement d'année"""
+    # Sélecteur d'année pour PnL Mensuel
+    years = df.attrs['years']
+    if len(years) > 1:
+        selected_year = st.selectbox("Sélectionner l'année", years)
+    else:
+        selected_year = years[0] if years else None
+    
+    monthly_pnl = calculate_monthly_pnl(df, selected_year)
+    fig_monthly = create_pnl_bar_chart(
+        monthly_pnl, 'Month_Name', 'PnL',
+        f'PnL Mensuel {selected_year}',
+        {'PnL': 'Profit/Perte', 'Month_Name': 'Mois'}
+    )
+    st.plotly_chart(fig_monthly, use_container_width=True)
+
 def main():
     st.title("📊 Analyse de Trading")
     
@@ -186,7 +344,12 @@ def main():
     
     if uploaded_file is not None:
         try:
-            df = load_data(uploaded_file)
+            df = load_data(file_key(uploaded_file), uploaded_file.getvalue(), uploaded_file.name)
+            
+            # Rien à analyser : éviter les statistiques sur un fichier vide
+            if df.empty:
+                st.warning("Le fichier ne contient aucune opération")
+                return
             
             # Afficher les données brutes dans une carte
             with st.expander("Données brutes", expanded=False):
@@ -286,40 +449,36 @@ def main():
             # Graphiques dans une carte
             st.subheader("📈 Visualisations")
             
-            # Sélecteur d'année pour PnL Mensuel
-            years = sorted(df['Date'].dt.year.unique())
-            if len(years) > 1:
-                selected_year = st.selectbox("Sélectionner l'année", years)
-            else:
-                selected_year = years[0] if years else None
-            
             # PnL Mensuel
-            monthly_pnl = calculate_monthly_pnl(df, selected_year)
-            fig_monthly = create_pnl_bar_chart(
-                monthly_pnl, 'Month_Name', 'PnL',
-                f'PnL Mensuel {selected_year}',
-                {'PnL': 'Profit/Perte', 'Month_Name': 'Mois'}
-            )
-            st.plotly_chart(fig_monthly, use_container_width=True)
+            monthly_pnl_section(df)
             
-            # PnL Journalier
             daily_pnl = calculate_daily_pnl(df)
-            fig_daily = create_pnl_bar_chart(
-                daily_pnl, 'Date', 'PnL',
-                'PnL Journalier',
-                {'PnL': 'Profit/Perte', 'Date': 'Date'}
-            )
-            st.plotly_chart(fig_daily, use_container_width=True)
+            asset_pnl = calculate_asset_pnl(df)
+            
+            # PnL Journalier, par semaine sur les longues périodes
+            if len(daily_pnl) > _MAX_DAILY_BARS:
+                charts = [(
+                    calculate_weekly_pnl(daily_pnl), 'Date', 'PnL',
+                    'PnL Hebdomadaire',
+                    {'PnL': 'Profit/Perte', 'Date': 'Semaine'}
+                )]
+            else:
+                charts = [(
+                    daily_pnl, 'Date', 'PnL',
+                    'PnL Journalier',
+                    {'PnL': 'Profit/Perte', 'Date': 'Date'}
+                )]
             
             # PnL par Asset
-            asset_pnl = calculate_asset_pnl(df)
             if asset_pnl is not None:
-                fig_asset = create_pnl_bar_chart(
+                charts.append((
                     asset_pnl, 'Asset', 'PnL',
                     'PnL par Asset',
                     {'PnL': 'Profit/Perte', 'Asset': 'Paire'}
-                )
-                st.plotly_chart(fig_asset, use_container_width=True)
+                ))
+            
+            # Une seule figure pour les graphiques qui ne dépendent pas de l'année
+            st.plotly_chart(create_pnl_subplots(charts), use_container_width=True)
             
         except Exception as e:
             st.error(f"Une erreur est survenue lors du traitement du fichier : {str(e)}")